@@ -1,21 +1,46 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, Response, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson.binary import Binary
+from pymongo import UpdateOne
+from pycrdt import Doc
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Dict, List, Optional, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import uuid
 import json
 import asyncio
 from datetime import datetime, timezone
-from collections import defaultdict
+from dataclasses import dataclass
+from collections import deque
 import time
-import statistics
+import array
+import math
+import itertools
+import struct
+import zlib
+
+# orjson is an optional speedup; fall back to the stdlib encoder without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+    
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+    
+    json_loads = json.loads
 
 ROOT_DIR = Path(__file__).parent
 # Load .env file if it exists (for local development)
@@ -29,38 +54,170 @@ db_name = os.environ.get('DB_NAME', 'coedit')
 client = AsyncIOMotorClient(mongo_url)
 db = client[db_name]
 
-# Create the main app without a prefix
-app = FastAPI()
+# Create the main app without a prefix; REST responses go through orjson when available
+app = FastAPI(default_response_class=ORJSONResponse if orjson is not None else JSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # ============== CRDT Document State ==============
-# In-memory store for Yjs document updates per room
-# In production, this would be Redis
+# Server-side Yjs document per room; clients send incremental updates that are
+# merged here. In production, this would be Redis
+room_ydocs: Dict[str, Doc] = {}
+# Encoded full state per room, built on demand and dropped on every update
 room_documents: Dict[str, bytes] = {}
-room_connections: Dict[str, Set[WebSocket]] = defaultdict(set)
-room_users: Dict[str, Dict[str, dict]] = defaultdict(dict)  # room_id -> {client_id -> user_info}
+# Binary sync frame per room (compressed when that pays off), same lifetime
+room_sync_frames: Dict[str, bytes] = {}
+# Plain dicts: rooms are created with setdefault on write paths and dropped
+# once empty, so lookups for unknown room ids never materialize entries.
+# Live connections are tracked by ConnectionManager.conns / room_index
+room_users: Dict[str, Dict[str, dict]] = {}  # room_id -> {client_id -> user_info}
+# Cached list(room_users[room_id].values()), dropped whenever the room's membership changes.
+# user_info dicts are shared, so in-place cursor/selection updates stay visible
+room_user_lists: Dict[str, List[dict]] = {}
+# Encoded JSON cursor message up to the position, per (room_id, client_id);
+# dropped when the user re-joins or disconnects
+cursor_prefixes: Dict[Tuple[str, str], str] = {}
+# Rooms changed since the last auto-persist
+dirty_rooms: Set[str] = set()
+
+
+def apply_room_update(room_id: str, update: bytes):
+    """Merge a Yjs update into the room's document; raises ValueError if it can't be decoded"""
+    ydoc = room_ydocs.get(room_id)
+    if ydoc is None:
+        ydoc = Doc()
+        ydoc.apply_update(update)
+        room_ydocs[room_id] = ydoc
+    else:
+        ydoc.apply_update(update)
+    room_documents.pop(room_id, None)
+    room_sync_frames.pop(room_id, None)
+    dirty_rooms.add(room_id)
+
+
+def get_room_state(room_id: str) -> bytes:
+    """Full Yjs state of the room (b'' if it has no document), cached until the next update"""
+    state = room_documents.get(room_id)
+    if state is None:
+        ydoc = room_ydocs.get(room_id)
+        if ydoc is None:
+            return b''
+        state = room_documents[room_id] = ydoc.get_update()
+        metrics.record_doc_size(room_id, len(state))
+    return state
+
+
+def get_sync_frame(room_id: str) -> bytes:
+    """Binary frame carrying the room's full state (b'' if it has no document)"""
+    frame = room_sync_frames.get(room_id)
+    if frame is None:
+        state = get_room_state(room_id)
+        if not state:
+            return b''
+        frame = DOC_FRAME_PREFIX + state
+        # Compressed once per document version and shared by every sync
+        if len(state) >= COMPRESS_MIN_SIZE:
+            compressed = zlib.compress(state)
+            if len(compressed) < len(state):
+                frame = DOC_DEFLATE_FRAME_PREFIX + compressed
+        room_sync_frames[room_id] = frame
+    return frame
+
+
+def get_room_user_list(room_id: str) -> List[dict]:
+    users = room_users.get(room_id)
+    if not users:
+        return []
+    user_list = room_user_lists.get(room_id)
+    if user_list is None:
+        user_list = room_user_lists[room_id] = list(users.values())
+    return user_list
+
+
+# Binary frame types - first byte of every binary WebSocket frame
+FRAME_DOC_UPDATE = 0x00  # followed by a Yjs update
+FRAME_CURSOR = 0x01  # CURSOR_FRAME layout
+FRAME_DOC_DEFLATE = 0x02  # followed by the zlib-compressed full Yjs state (server -> client)
+DOC_FRAME_PREFIX = bytes([FRAME_DOC_UPDATE])
+DOC_DEFLATE_FRAME_PREFIX = bytes([FRAME_DOC_DEFLATE])
+# Sync snapshots smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+# type, sender ordinal (filled in by the server), cursor position
+CURSOR_FRAME = struct.Struct('<BIi')
+
+# Seconds a single send may take before the recipient is dropped
+SEND_TIMEOUT = 5.0
+# Outbound messages buffered per client. Document frames are deltas and can't be
+# dropped, so a client this far behind is disconnected and resyncs on reconnect
+OUTBOUND_QUEUE_SIZE = 256
+# Broadcasts to bigger rooms yield to the event loop after each chunk of clients
+BROADCAST_CHUNK_SIZE = 256
+
+# Fixed replies, encoded once at import
+ERROR_INVALID_JSON = json_dumps({"type": "error", "message": "Invalid JSON"})
+ERROR_INVALID_UPDATE = json_dumps({"type": "error", "message": "Invalid update data"})
+PONG_TEMPLATE = '{"type":"pong","timestamp":%s}'
+# userId, name, color; completed with the position and a closing brace
+CURSOR_PREFIX_TEMPLATE = '{"type":"cursor","userId":%s,"name":%s,"color":%s,"position":'
 
 # ============== Metrics Collection ==============
+# Latency histogram: log-linear buckets from 1µs up to ~134s (27 octaves),
+# 16 buckets per octave keeps the reported percentile within ~2.2%.
+# Handling time alone is mostly sub-100µs, so the floor has to sit well below that
+LATENCY_MIN_MS = 0.001
+LATENCY_MIN_NS = 1_000
+LATENCY_BUCKETS_PER_OCTAVE = 16
+LATENCY_BUCKET_COUNT = LATENCY_BUCKETS_PER_OCTAVE * 27
+# Scrapes within this many seconds of each other share one get_stats result
+STATS_CACHE_TTL = 0.25
+
+
+def latency_bucket(latency_ns: int) -> int:
+    if latency_ns <= LATENCY_MIN_NS:
+        return 0
+    idx = int(math.log2(latency_ns / LATENCY_MIN_NS) * LATENCY_BUCKETS_PER_OCTAVE)
+    return min(idx, LATENCY_BUCKET_COUNT - 1)
+
+
+def latency_bucket_midpoint(idx: int) -> float:
+    # Geometric midpoint of the bucket's [lower, upper) bounds
+    return LATENCY_MIN_MS * 2 ** ((idx + 0.5) / LATENCY_BUCKETS_PER_OCTAVE)
+
+
 class MetricsCollector:
     def __init__(self):
         self.message_count = 0
         self.error_count = 0
         self.reconnect_count = 0
-        self.latencies: List[float] = []
-        self.start_time = time.time()
+        self.latency_hist = array.array('Q', [0] * LATENCY_BUCKET_COUNT)
+        # Bucket index of each of the last 1000 latencies, so the oldest can be evicted
+        self.latency_window: deque = deque(maxlen=1000)
+        # (message_count, [p50, p95]) from the last scrape
+        self._percentiles_cache = (0, [0, 0])
+        self._stats_cache: Optional[dict] = None
+        self._stats_cache_ts = 0.0
+        self.start_time = time.monotonic()
+        # Encoded size per room, recorded whenever the full state is encoded.
+        # Auto-persist encodes every dirty room, so this lags by at most AUTO_PERSIST_INTERVAL
         self.doc_sizes: Dict[str, int] = {}
-        self.events: List[dict] = []
+        # Running totals so get_stats doesn't walk every room
+        self._total_connections = 0
+        self._total_doc_bytes = 0
         self.max_events = 100
+        self.events: deque = deque(maxlen=self.max_events)
+        # Event ids are internal only, a counter is enough
+        self._event_seq = itertools.count(1)
     
-    def record_message(self, latency_ms: float = 0):
+    def record_message_ns(self, latency_ns: int = 0):
         self.message_count += 1
-        if latency_ms > 0:
-            self.latencies.append(latency_ms)
-            # Keep only last 1000 latencies
-            if len(self.latencies) > 1000:
-                self.latencies = self.latencies[-1000:]
+        if latency_ns > 0:
+            window = self.latency_window
+            if len(window) == window.maxlen:
+                self.latency_hist[window[0]] -= 1
+            idx = latency_bucket(latency_ns)
+            window.append(idx)
+            self.latency_hist[idx] += 1
     
     def record_error(self):
         self.error_count += 1
@@ -69,58 +226,214 @@ class MetricsCollector:
         self.reconnect_count += 1
     
     def record_doc_size(self, room_id: str, size: int):
+        self._total_doc_bytes += size - self.doc_sizes.get(room_id, 0)
         self.doc_sizes[room_id] = size
     
+    def inc_conn(self, delta: int = 1):
+        self._total_connections += delta
+    
     def add_event(self, event_type: str, room_id: str, user_id: str = "", details: str = ""):
+        # Timestamp is kept as epoch seconds and only formatted in get_events
         event = {
-            "id": str(uuid.uuid4()),
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "id": next(self._event_seq),
+            "ts": time.time(),
             "type": event_type,
             "room_id": room_id,
             "user_id": user_id,
             "details": details
         }
         self.events.append(event)
-        if len(self.events) > self.max_events:
-            self.events = self.events[-self.max_events:]
+    
+    def add_events(self, events: Iterable[tuple]):
+        """Batch form of add_event for (event_type, room_id, user_id, details) tuples"""
+        ts = time.time()
+        self.events.extend(
+            {
+                "id": next(self._event_seq),
+                "ts": ts,
+                "type": event_type,
+                "room_id": room_id,
+                "user_id": user_id,
+                "details": details
+            }
+            for event_type, room_id, user_id, details in events
+        )
+    
+    def latency_percentiles(self, *quantiles: float) -> List[float]:
+        """Nearest-rank percentiles from the histogram, one bucket walk for all quantiles"""
+        count = len(self.latency_window)
+        if not count:
+            return [0] * len(quantiles)
+        # Same nearest-rank definition as sorted(latencies)[int(n * q)]
+        ranks = [min(int(count * q), count - 1) + 1 for q in quantiles]
+        results = []
+        cumulative = 0
+        for idx, bucket_count in enumerate(self.latency_hist):
+            if not bucket_count:
+                continue
+            cumulative += bucket_count
+            while len(results) < len(ranks) and cumulative >= ranks[len(results)]:
+                results.append(latency_bucket_midpoint(idx))
+            if len(results) == len(ranks):
+                break
+        return results
     
     def get_stats(self) -> dict:
-        uptime = time.time() - self.start_time
-        messages_per_sec = self.message_count / uptime if uptime > 0 else 0
+        now = time.monotonic()
+        if self._stats_cache is not None and now - self._stats_cache_ts < STATS_CACHE_TTL:
+            return self._stats_cache
         
-        p50_latency = 0
-        p95_latency = 0
-        if self.latencies:
-            sorted_latencies = sorted(self.latencies)
-            p50_idx = int(len(sorted_latencies) * 0.5)
-            p95_idx = int(len(sorted_latencies) * 0.95)
-            p50_latency = sorted_latencies[p50_idx] if p50_idx < len(sorted_latencies) else 0
-            p95_latency = sorted_latencies[p95_idx] if p95_idx < len(sorted_latencies) else 0
+        uptime = now - self.start_time
+        messages_per_sec = self.message_count / uptime if uptime > 0 else 0
         
-        total_connections = sum(len(conns) for conns in room_connections.values())
-        total_doc_size = sum(self.doc_sizes.values())
+        # Reuse the previous walk when no latency was recorded since the last scrape
+        cached_count, percentiles = self._percentiles_cache
+        if cached_count != self.message_count:
+            percentiles = self.latency_percentiles(0.5, 0.95)
+            self._percentiles_cache = (self.message_count, percentiles)
+        p50_latency, p95_latency = percentiles
         
-        return {
-            "active_connections": total_connections,
+        self._stats_cache = {
+            "active_connections": self._total_connections,
             "messages_per_sec": round(messages_per_sec, 2),
-            "p50_latency_ms": round(p50_latency, 2),
-            "p95_latency_ms": round(p95_latency, 2),
+            "p50_latency_ms": round(p50_latency, 3),
+            "p95_latency_ms": round(p95_latency, 3),
             "error_count": self.error_count,
             "reconnect_count": self.reconnect_count,
-            "total_doc_size_bytes": total_doc_size,
+            "total_doc_size_bytes": self._total_doc_bytes,
             "uptime_seconds": round(uptime, 0),
             "total_messages": self.message_count,
-            "rooms_active": len(room_connections)
+            "rooms_active": len(manager.room_index)
         }
+        self._stats_cache_ts = now
+        return self._stats_cache
     
     def get_events(self, limit: int = 50) -> List[dict]:
-        return self.events[-limit:]
+        """Newest `limit` events, oldest first; limit <= 0 returns all of them"""
+        events = []
+        # Walk from the newest end so only the returned entries are visited
+        newest = reversed(self.events)
+        if limit > 0:
+            newest = itertools.islice(newest, limit)
+        for event in newest:
+            event = dict(event)
+            # Serialized to ISO-8601 by the response class
+            event["timestamp"] = datetime.fromtimestamp(event.pop("ts"), timezone.utc)
+            events.append(event)
+        events.reverse()
+        return events
 
 
 metrics = MetricsCollector()
 
 
+# ============== Persistence ==============
+class DocumentPersister:
+    """Writes room documents to MongoDB in batches from a background task.
+    
+    Holds at most one pending snapshot per room: a newer one replaces the
+    older, so memory stays bounded by the number of rooms even if MongoDB stalls.
+    """
+    
+    def __init__(self, batch_size: int = 200, batch_timeout: float = 0.5):
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        # room_id -> latest full state, in the order rooms were first queued
+        self.pending: Dict[str, bytes] = {}
+        self._wakeup = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the worker once everything pending has been written"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._batch_full.set()
+            await self._task
+            self._task = None
+        else:
+            # Worker never ran; write what is pending directly
+            batch, self.pending = self.pending, {}
+            await self._flush(batch)
+    
+    def enqueue(self, room_id: str, state: bytes):
+        self.pending[room_id] = state
+        self._wakeup.set()
+        if len(self.pending) >= self.batch_size:
+            self._batch_full.set()
+    
+    async def _run(self):
+        while True:
+            if not self._stopping:
+                await self._wakeup.wait()
+                # Give more rooms batch_timeout to join, unless the batch is already full
+                if not self._stopping and len(self.pending) < self.batch_size:
+                    try:
+                        await asyncio.wait_for(self._batch_full.wait(), self.batch_timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            self._wakeup.clear()
+            self._batch_full.clear()
+            if not self.pending:
+                if self._stopping:
+                    return
+                continue
+            room_ids = list(itertools.islice(self.pending, self.batch_size))
+            batch = {room_id: self.pending.pop(room_id) for room_id in room_ids}
+            if self.pending:
+                self._wakeup.set()
+            await self._flush(batch)
+    
+    async def _flush(self, batch: Dict[str, bytes]):
+        if not batch:
+            return
+        updated_at = datetime.now(timezone.utc).isoformat()
+        try:
+            await db.room_documents.bulk_write(
+                [UpdateOne({"room_id": room_id}, {"$set": {
+                    "room_id": room_id,
+                    "data": Binary(state),
+                    "updated_at": updated_at,
+                    "size": len(state)
+                }}, upsert=True) for room_id, state in batch.items()],
+                ordered=False
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist {len(batch)} room(s): {e}")
+            # Retry on the next auto-persist tick with whatever state is current then
+            dirty_rooms.update(batch)
+
+
+persister = DocumentPersister()
+
+# Seconds between automatic saves of rooms with unsaved changes
+AUTO_PERSIST_INTERVAL = 5.0
+
+
+def persist_dirty_rooms():
+    """Queue every room changed since the last call for the next batched write"""
+    rooms = list(dirty_rooms)
+    dirty_rooms.clear()
+    for room_id in rooms:
+        state = get_room_state(room_id)
+        if state:
+            persister.enqueue(room_id, state)
+
+
+async def auto_persist_loop():
+    while True:
+        await asyncio.sleep(AUTO_PERSIST_INTERVAL)
+        persist_dirty_rooms()
+
+
 # ============== Models ==============
+# REST-only. WebSocket messages stay plain dicts (see handle_json_message)
 class StatusCheck(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -178,55 +491,43 @@ async def get_events(limit: int = 50):
 @api_router.get("/rooms")
 async def list_rooms():
     rooms = []
-    for room_id, connections in room_connections.items():
-        room_doc = room_documents.get(room_id, '')
+    for room_id, client_ids in manager.room_index.items():
         rooms.append({
             "id": room_id,
             "name": room_id,
-            "user_count": len(connections),
-            "doc_size": len(room_doc) // 2 if room_doc else 0,  # hex is 2 chars per byte
-            "users": list(room_users.get(room_id, {}).values())
+            "user_count": len(client_ids),
+            "doc_size": metrics.doc_sizes.get(room_id, 0),
+            "users": get_room_user_list(room_id)
         })
     return rooms
 
 
 @api_router.get("/rooms/{room_id}")
 async def get_room(room_id: str):
-    connections = room_connections.get(room_id, set())
-    room_doc = room_documents.get(room_id, '')
-    users = room_users.get(room_id, {})
     return {
         "id": room_id,
         "name": room_id,
-        "user_count": len(connections),
-        "doc_size": len(room_doc) // 2 if room_doc else 0,  # hex is 2 chars per byte
-        "users": list(users.values())
+        "user_count": len(manager.room_index.get(room_id, ())),
+        "doc_size": metrics.doc_sizes.get(room_id, 0),
+        "users": get_room_user_list(room_id)
     }
 
 
 @api_router.get("/rooms/{room_id}/users")
 async def get_room_users(room_id: str):
-    users = room_users.get(room_id, {})
-    return list(users.values())
+    return get_room_user_list(room_id)
 
 
-@api_router.post("/rooms/{room_id}/persist")
-async def persist_room(room_id: str):
-    """Persist room document to MongoDB"""
-    room_doc = room_documents.get(room_id, '')
+@api_router.post("/rooms/{room_id}/persist", status_code=202)
+async def persist_room(room_id: str, response: Response):
+    """Queue the room document for the next batched MongoDB write"""
+    room_doc = get_room_state(room_id)
     if room_doc:
-        doc = {
-            "room_id": room_id,
-            "data": room_doc,  # Already stored as hex string
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-            "size": len(room_doc)
-        }
-        await db.room_documents.update_one(
-            {"room_id": room_id},
-            {"$set": doc},
-            upsert=True
-        )
-        return {"success": True, "size": len(room_doc)}
+        persister.enqueue(room_id, room_doc)
+        dirty_rooms.discard(room_id)
+        # Accepted, not yet written: the next batch (within batch_timeout) saves it
+        return {"success": True, "status": "queued", "size": len(room_doc)}
+    response.status_code = 200
     return {"success": False, "error": "No document found"}
 
 
@@ -235,57 +536,168 @@ async def load_room(room_id: str):
     """Load room document from MongoDB"""
     doc = await db.room_documents.find_one({"room_id": room_id}, {"_id": 0})
     if doc:
-        room_documents[room_id] = doc["data"]  # Store as hex string
+        # Connected Yjs clients would merge a replaced document back into their
+        # own state instead of dropping it, so only idle rooms can be loaded.
+        # Checked after the await, with no await between here and the swap
+        if manager.room_index.get(room_id):
+            return {"success": False, "error": "Room has active connections"}
+        data = doc["data"]
+        # Decode into a fresh Doc so a corrupt record leaves the live document alone
+        ydoc = Doc()
+        try:
+            # Documents persisted before the switch to BSON binary hold a hex string
+            state = bytes.fromhex(data) if isinstance(data, str) else bytes(data)
+            ydoc.apply_update(state)
+        except (TypeError, ValueError):
+            metrics.record_error()
+            return {"success": False, "error": "Persisted document is corrupt"}
+        # Loading replaces the in-memory document rather than merging into it
+        room_ydocs[room_id] = ydoc
+        room_documents.pop(room_id, None)
+        room_sync_frames.pop(room_id, None)
+        metrics.record_doc_size(room_id, len(state))
+        # Same as what is stored, no need to write it back
+        dirty_rooms.discard(room_id)
         return {"success": True, "size": doc.get("size", 0)}
     return {"success": False, "error": "No persisted document found"}
 
 
 # ============== WebSocket Handler ==============
+@dataclass
+class ClientConn:
+    websocket: WebSocket
+    # Outbound ASGI "websocket.send" messages, built once per broadcast and shared
+    queue: asyncio.Queue
+    relay_task: Optional[asyncio.Task] = None
+
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = defaultdict(dict)
+        # One flat map for all connections, plus the client ids of each room in join order
+        self.conns: Dict[Tuple[str, str], ClientConn] = {}
+        self.room_index: Dict[str, List[str]] = {}
+        # Pending socket closes started by _drop, kept referenced until done
+        self._closing: Set[asyncio.Task] = set()
+        self._next_ord = 0
     
-    async def connect(self, websocket: WebSocket, room_id: str, client_id: str):
+    def next_ordinal(self) -> int:
+        """Compact 32-bit id identifying a joined user in binary cursor frames"""
+        self._next_ord = (self._next_ord + 1) & 0xFFFFFFFF
+        return self._next_ord
+    
+    async def connect(self, websocket: WebSocket, room_id: str, client_id: str) -> ClientConn:
         await websocket.accept()
-        self.active_connections[room_id][client_id] = websocket
-        room_connections[room_id].add(websocket)
+        conn = ClientConn(websocket, asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE))
+        conn.relay_task = asyncio.create_task(self._relay(room_id, client_id, conn))
+        key = (room_id, client_id)
+        old = self.conns.get(key)
+        if old is None:
+            self.room_index.setdefault(room_id, []).append(client_id)
+            metrics.inc_conn(1)
+        else:
+            # Reconnect under the same id: the new socket takes over the slot
+            old.relay_task.cancel()
+        self.conns[key] = conn
         metrics.add_event("connect", room_id, client_id, "User connected")
+        return conn
     
-    def disconnect(self, room_id: str, client_id: str):
-        if room_id in self.active_connections:
-            ws = self.active_connections[room_id].pop(client_id, None)
-            if ws:
-                room_connections[room_id].discard(ws)
-            if client_id in room_users.get(room_id, {}):
-                del room_users[room_id][client_id]
+    def disconnect(self, room_id: str, client_id: str, conn: ClientConn) -> bool:
+        """Remove `conn` and its user; False if it was already removed or replaced"""
+        key = (room_id, client_id)
+        if self.conns.get(key) is not conn:
+            return False
+        del self.conns[key]
+        client_ids = self.room_index[room_id]
+        client_ids.remove(client_id)
+        if not client_ids:
+            del self.room_index[room_id]
+        metrics.inc_conn(-1)
+        if conn.relay_task is not asyncio.current_task():
+            conn.relay_task.cancel()
+        cursor_prefixes.pop(key, None)
+        users = room_users.get(room_id)
+        if users is not None and client_id in users:
+            del users[client_id]
+            room_user_lists.pop(room_id, None)
+            if not users:
+                del room_users[room_id]
         metrics.add_event("disconnect", room_id, client_id, "User disconnected")
+        return True
+    
+    async def _relay(self, room_id: str, client_id: str, conn: ClientConn):
+        """Drain one client's queue into its socket, so a slow client only delays itself"""
+        websocket = conn.websocket
+        try:
+            while True:
+                frame = await conn.queue.get()
+                await asyncio.wait_for(websocket.send(frame), timeout=SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Closed socket, WebSocketDisconnect or a send stuck past SEND_TIMEOUT
+            self._drop(room_id, client_id, conn, 1011)
+    
+    def _drop(self, room_id: str, client_id: str, conn: ClientConn, code: int):
+        """Remove a client we can no longer deliver to and close its socket,
+        so the editor reconnects and resyncs instead of silently falling behind"""
+        # No-op if the client already left or reconnected under the same id
+        if self.disconnect(room_id, client_id, conn):
+            # Closing can stall on a stuck socket, so it never blocks the caller
+            task = asyncio.create_task(self._close(room_id, client_id, conn, code))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+    
+    async def _close(self, room_id: str, client_id: str, conn: ClientConn, code: int):
+        try:
+            await asyncio.wait_for(conn.websocket.close(code=code), timeout=SEND_TIMEOUT)
+        except Exception:
+            pass  # Already closed or stuck; the socket is unregistered either way
+        await self.broadcast(room_id, {
+            "type": "user_left",
+            "userId": client_id
+        })
+    
+    def _enqueue(self, room_id: str, client_ids: List[str], frame: dict, exclude_client: str = None):
+        conns = self.conns
+        overflowed = []
+        for client_id in client_ids:
+            if client_id == exclude_client:
+                continue
+            conn = conns.get((room_id, client_id))
+            if conn is None:
+                # Left while a chunked broadcast was yielding
+                continue
+            queue = conn.queue
+            if queue.full():
+                overflowed.append((client_id, conn))
+            else:
+                queue.put_nowait(frame)
+        # Disconnect after the loop: it edits room_index, which may be client_ids
+        for client_id, conn in overflowed:
+            self._drop(room_id, client_id, conn, 1013)
+    
+    async def _enqueue_all(self, room_id: str, frame: dict, exclude_client: str = None):
+        client_ids = self.room_index.get(room_id)
+        if not client_ids:
+            return
+        if len(client_ids) <= BROADCAST_CHUNK_SIZE:
+            self._enqueue(room_id, client_ids, frame, exclude_client)
+            return
+        # Large room: work on a snapshot and let other handlers run between chunks
+        client_ids = list(client_ids)
+        for start in range(0, len(client_ids), BROADCAST_CHUNK_SIZE):
+            self._enqueue(room_id, client_ids[start:start + BROADCAST_CHUNK_SIZE], frame, exclude_client)
+            await asyncio.sleep(0)
     
     async def broadcast(self, room_id: str, message: dict, exclude_client: str = None):
-        if room_id in self.active_connections:
-            disconnected = []
-            for client_id, connection in self.active_connections[room_id].items():
-                if client_id != exclude_client:
-                    try:
-                        await connection.send_json(message)
-                    except Exception:
-                        disconnected.append(client_id)
-            
-            # Clean up disconnected clients
-            for client_id in disconnected:
-                self.disconnect(room_id, client_id)
+        # Encode once for the whole room instead of once per recipient
+        await self._enqueue_all(room_id, {"type": "websocket.send", "text": json_dumps(message)}, exclude_client)
+    
+    async def broadcast_text(self, room_id: str, text: str, exclude_client: str = None):
+        await self._enqueue_all(room_id, {"type": "websocket.send", "text": text}, exclude_client)
     
     async def broadcast_bytes(self, room_id: str, data: bytes, exclude_client: str = None):
-        if room_id in self.active_connections:
-            disconnected = []
-            for client_id, connection in self.active_connections[room_id].items():
-                if client_id != exclude_client:
-                    try:
-                        await connection.send_bytes(data)
-                    except Exception:
-                        disconnected.append(client_id)
-            
-            for client_id in disconnected:
-                self.disconnect(room_id, client_id)
+        await self._enqueue_all(room_id, {"type": "websocket.send", "bytes": data}, exclude_client)
 
 
 manager = ConnectionManager()
@@ -294,45 +706,45 @@ manager = ConnectionManager()
 @app.websocket("/api/ws/{room_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str, client_id: str = None):
     if not client_id:
-        client_id = str(uuid.uuid4())
+        client_id = uuid.uuid4().hex
     
-    await manager.connect(websocket, room_id, client_id)
+    conn = await manager.connect(websocket, room_id, client_id)
     
-    # Send initial sync - send existing document state
-    if room_id in room_documents and room_documents[room_id]:
-        await websocket.send_json({
-            "type": "sync",
-            "data": room_documents[room_id]  # Already stored as hex string
-        })
+    # Send initial sync - existing document state as a binary frame
+    sync_frame = get_sync_frame(room_id)
+    if sync_frame:
+        await websocket.send_bytes(sync_frame)
     
     # Send current users in room
-    await websocket.send_json({
+    await websocket.send_text(json_dumps({
         "type": "users",
-        "users": list(room_users.get(room_id, {}).values())
-    })
+        "users": get_room_user_list(room_id)
+    }))
     
     try:
         while True:
-            start_time = time.time()
-            
             try:
                 # Try to receive as JSON first
                 data = await websocket.receive()
+                if data["type"] == "websocket.disconnect":
+                    break
+                # Time handling only, not the wait for the next frame
+                start_ns = time.perf_counter_ns()
                 
                 if "text" in data:
-                    message = json.loads(data["text"])
+                    message = json_loads(data["text"])
                     await handle_json_message(websocket, room_id, client_id, message)
                 elif "bytes" in data:
                     # Handle binary Yjs updates
                     await handle_binary_message(websocket, room_id, client_id, data["bytes"])
                 
-                latency_ms = (time.time() - start_time) * 1000
-                metrics.record_message(latency_ms)
+                metrics.record_message_ns(time.perf_counter_ns() - start_ns)
                 
+            # orjson.JSONDecodeError subclasses json.JSONDecodeError
             except json.JSONDecodeError:
                 metrics.record_error()
                 try:
-                    await websocket.send_json({"type": "error", "message": "Invalid JSON"})
+                    await websocket.send_text(ERROR_INVALID_JSON)
                 except:
                     break  # Connection is closed
             except WebSocketDisconnect:
@@ -345,169 +757,243 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, client_id: str
     except WebSocketDisconnect:
         pass  # Normal disconnect
     finally:
-        manager.disconnect(room_id, client_id)
-        # Notify others about user leaving
-        try:
-            await manager.broadcast(room_id, {
-                "type": "user_left",
-                "userId": client_id
-            })
-        except:
-            pass  # Ignore errors during cleanup
+        # A newer socket under the same id keeps the user; only announce a real leave
+        if manager.disconnect(room_id, client_id, conn):
+            # Notify others about user leaving
+            try:
+                await manager.broadcast(room_id, {
+                    "type": "user_left",
+                    "userId": client_id
+                })
+            except:
+                pass  # Ignore errors during cleanup
 
 
-async def handle_json_message(websocket: WebSocket, room_id: str, client_id: str, message: dict):
-    msg_type = message.get("type")
-    
-    if msg_type == "join":
-        # User joining with info
-        user_info = {
-            "id": client_id,
-            "name": message.get("name", f"User-{client_id[:6]}"),
-            "color": message.get("color", "#3B82F6"),
-            "avatar_url": message.get("avatar_url"),
-            "cursor_position": None,
-            "selection": None
-        }
-        room_users[room_id][client_id] = user_info
-        metrics.add_event("join", room_id, client_id, f"User {user_info['name']} joined")
-        
-        # Broadcast to all users (including the new one to get the list)
-        await manager.broadcast(room_id, {
-            "type": "user_joined",
-            "userId": client_id,
-            "name": user_info["name"],
-            "color": user_info["color"]
-        }, exclude_client=client_id)
-        
-        # Send the current users list to the joining user
-        users_list = [
-            {"id": uid, "name": u["name"], "color": u["color"], "cursorPosition": u.get("cursor_position")}
-            for uid, u in room_users.get(room_id, {}).items()
-            if uid != client_id
-        ]
-        await websocket.send_json({
-            "type": "users_list",
-            "users": users_list
-        })
+def _room_user(room_id: str, client_id: str) -> Optional[dict]:
+    users = room_users.get(room_id)
+    return users.get(client_id) if users is not None else None
+
+
+async def _handle_join(websocket: WebSocket, room_id: str, client_id: str, message: dict):
+    # User joining with info
+    user_info = {
+        "id": client_id,
+        "name": message.get("name", f"User-{client_id[:6]}"),
+        "color": message.get("color", "#3B82F6"),
+        "avatar_url": message.get("avatar_url"),
+        "cursor_position": None,
+        "selection": None,
+        "ord": manager.next_ordinal()
+    }
+    users = room_users.setdefault(room_id, {})
+    users[client_id] = user_info
+    room_user_lists.pop(room_id, None)
+    cursor_prefixes.pop((room_id, client_id), None)
+    metrics.add_event("join", room_id, client_id, f"User {user_info['name']} joined")
     
-    elif msg_type == "cursor":
-        # Cursor position update
-        if client_id in room_users.get(room_id, {}):
-            room_users[room_id][client_id]["cursor_position"] = message.get("position")
-            user_info = room_users[room_id][client_id]
-            await manager.broadcast(room_id, {
-                "type": "cursor",
-                "userId": client_id,
-                "name": user_info.get("name", "Anonymous"),
-                "color": user_info.get("color", "#3B82F6"),
-                "position": message.get("position")
-            }, exclude_client=client_id)
-    
-    elif msg_type == "selection":
-        # Selection update
-        if client_id in room_users.get(room_id, {}):
-            room_users[room_id][client_id]["selection"] = message.get("selection")
-            await manager.broadcast(room_id, {
-                "type": "selection",
-                "user_id": client_id,
-                "selection": message.get("selection")
-            }, exclude_client=client_id)
+    # Broadcast to all users (including the new one to get the list)
+    await manager.broadcast(room_id, {
+        "type": "user_joined",
+        "userId": client_id,
+        "name": user_info["name"],
+        "color": user_info["color"],
+        "ord": user_info["ord"]
+    }, exclude_client=client_id)
     
-    elif msg_type == "awareness":
-        # Awareness protocol message
+    # Send the current users list to the joining user
+    users_list = [
+        {"id": uid, "name": u["name"], "color": u["color"], "cursorPosition": u.get("cursor_position"),
+         "ord": u.get("ord")}
+        for uid, u in users.items()
+        if uid != client_id
+    ]
+    await websocket.send_text(json_dumps({
+        "type": "users_list",
+        "users": users_list
+    }))
+
+
+async def _handle_cursor(websocket: WebSocket, room_id: str, client_id: str, message: dict):
+    # Cursor position update
+    user_info = _room_user(room_id, client_id)
+    if user_info is not None:
+        position = message.get("position")
+        user_info["cursor_position"] = position
+        # Only the position changes between a user's cursor messages
+        key = (room_id, client_id)
+        prefix = cursor_prefixes.get(key)
+        if prefix is None:
+            prefix = cursor_prefixes[key] = CURSOR_PREFIX_TEMPLATE % (
+                json_dumps(client_id),
+                json_dumps(user_info.get("name", "Anonymous")),
+                json_dumps(user_info.get("color", "#3B82F6"))
+            )
+        await manager.broadcast_text(room_id, prefix + json_dumps(position) + "}", exclude_client=client_id)
+
+
+async def _handle_selection(websocket: WebSocket, room_id: str, client_id: str, message: dict):
+    # Selection update
+    user_info = _room_user(room_id, client_id)
+    if user_info is not None:
+        selection = message.get("selection")
+        user_info["selection"] = selection
         await manager.broadcast(room_id, {
-            "type": "awareness",
+            "type": "selection",
             "user_id": client_id,
-            "data": message.get("data")
+            "selection": selection
         }, exclude_client=client_id)
+
+
+async def _handle_awareness(websocket: WebSocket, room_id: str, client_id: str, message: dict):
+    # Awareness protocol message
+    await manager.broadcast(room_id, {
+        "type": "awareness",
+        "user_id": client_id,
+        "data": message.get("data")
+    }, exclude_client=client_id)
+
+
+async def _handle_sync_request(websocket: WebSocket, room_id: str, client_id: str, message: dict):
+    # Client requesting full sync
+    sync_frame = get_sync_frame(room_id)
+    if sync_frame:
+        await websocket.send_bytes(sync_frame)
+
+
+async def _handle_update(websocket: WebSocket, room_id: str, client_id: str, message: dict):
+    # Legacy hex-encoded update: decode once, then merge and forward it
+    # as a binary document frame like handle_binary_message does
+    try:
+        update = bytes.fromhex(message.get("data") or "")
+        if update:
+            apply_room_update(room_id, update)
+    except (TypeError, ValueError):
+        metrics.record_error()
+        await websocket.send_text(ERROR_INVALID_UPDATE)
+        return
+    if update:
+        await manager.broadcast_bytes(room_id, DOC_FRAME_PREFIX + update, exclude_client=client_id)
+
+
+async def _handle_ping(websocket: WebSocket, room_id: str, client_id: str, message: dict):
+    # Only the echoed timestamp is encoded per ping
+    await websocket.send_text(PONG_TEMPLATE % json_dumps(message.get("timestamp")))
+
+
+# Text frame handlers by message "type"; unknown types are ignored
+JSON_HANDLERS = {
+    "join": _handle_join,
+    "cursor": _handle_cursor,
+    "selection": _handle_selection,
+    "awareness": _handle_awareness,
+    "sync_request": _handle_sync_request,
+    "update": _handle_update,
+    "ping": _handle_ping,
+}
+
+
+async def handle_json_message(websocket: WebSocket, room_id: str, client_id: str, message: dict):
+    """Dispatch a decoded text frame.
     
-    elif msg_type == "sync_request":
-        # Client requesting full sync
-        if room_id in room_documents and room_documents[room_id]:
-            await websocket.send_json({
-                "type": "sync",
-                "data": room_documents[room_id]  # Already stored as hex string
-            })
-    
-    elif msg_type == "update":
-        # Document update (hex encoded) - this is the FULL Yjs state
-        update_data = message.get("data", "")
-        if update_data:
-            # Store the full state (not concatenating - the client sends full state)
-            room_documents[room_id] = update_data  # Store as hex string
-            metrics.record_doc_size(room_id, len(update_data))
-            
-            # Broadcast to others
-            await manager.broadcast(room_id, {
-                "type": "update",
-                "data": update_data,
-                "from": client_id
-            }, exclude_client=client_id)
-    
-    elif msg_type == "ping":
-        await websocket.send_json({"type": "pong", "timestamp": message.get("timestamp")})
+    Runs once per message, so messages and user_info are handled as plain
+    dicts - don't validate them through the Pydantic models above.
+    """
+    handler = JSON_HANDLERS.get(message.get("type"))
+    if handler is not None:
+        await handler(websocket, room_id, client_id, message)
 
 
 async def handle_binary_message(websocket: WebSocket, room_id: str, client_id: str, data: bytes):
-    """Handle binary Yjs update messages"""
-    # Store the update as hex string (full state)
-    room_documents[room_id] = data.hex()
-    metrics.record_doc_size(room_id, len(data))
+    """Handle binary frames, dispatched on the first byte"""
+    if not data:
+        return
+    frame_type = data[0]
     
-    # Broadcast to all other clients as JSON with hex data
-    await manager.broadcast(room_id, {
-        "type": "update",
-        "data": data.hex(),
-        "from": client_id
-    }, exclude_client=client_id)
+    if frame_type == FRAME_DOC_UPDATE:
+        # Incremental Yjs update - merge into the room's document
+        try:
+            apply_room_update(room_id, data[1:])
+        except ValueError:
+            metrics.record_error()
+            await websocket.send_text(ERROR_INVALID_UPDATE)
+            return
+        
+        # Forward the frame unchanged to all other clients
+        await manager.broadcast_bytes(room_id, data, exclude_client=client_id)
+    
+    elif frame_type == FRAME_CURSOR and len(data) == CURSOR_FRAME.size:
+        user_info = _room_user(room_id, client_id)
+        if user_info is not None:
+            _, _, position = CURSOR_FRAME.unpack(data)
+            user_info["cursor_position"] = position
+            # Stamp the sender's ordinal; the client leaves it zero
+            await manager.broadcast_bytes(
+                room_id,
+                CURSOR_FRAME.pack(FRAME_CURSOR, user_info["ord"], position),
+                exclude_client=client_id
+            )
 
 
 # ============== Load Testing Simulation ==============
 @api_router.post("/simulate/users/{room_id}")
 async def simulate_users(room_id: str, count: int = 10):
     """Simulate multiple users joining a room for load testing"""
+    if count <= 0:
+        return {"success": True, "simulated_users": 0, "total_users": len(room_users.get(room_id, {}))}
+    
     simulated_users = []
     colors = ["#F43F5E", "#10B981", "#3B82F6", "#F59E0B", "#8B5CF6", "#EC4899"]
+    ncolors = len(colors)
+    users = room_users.setdefault(room_id, {})
+    # 8 hex chars per user from one urandom read, instead of a uuid4 each
+    id_hex = os.urandom(4 * count).hex()
     
     for i in range(count):
-        user_id = f"sim-{uuid.uuid4().hex[:8]}"
+        user_id = f"sim-{id_hex[8 * i:8 * i + 8]}"
         user_info = {
             "id": user_id,
             "name": f"SimUser-{i+1}",
-            "color": colors[i % len(colors)],
+            "color": colors[i % ncolors],
             "avatar_url": None,
             "cursor_position": {"line": i % 20, "column": (i * 5) % 80},
             "selection": None,
             "simulated": True
         }
-        room_users[room_id][user_id] = user_info
+        users[user_id] = user_info
         simulated_users.append(user_info)
-        metrics.add_event("simulate", room_id, user_id, f"Simulated user {user_info['name']}")
+    room_user_lists.pop(room_id, None)
     
-    # Broadcast new simulated users
-    for user in simulated_users:
-        await manager.broadcast(room_id, {
-            "type": "user_joined",
-            "user": user
-        })
+    metrics.add_events(
+        ("simulate", room_id, user["id"], f"Simulated user {user['name']}") for user in simulated_users
+    )
+    
+    # Announce all simulated users in one broadcast
+    total_users = len(users)
+    await manager.broadcast(room_id, {
+        "type": "users_joined",
+        "users": simulated_users
+    })
     
-    return {"success": True, "simulated_users": len(simulated_users), "total_users": len(room_users[room_id])}
+    return {"success": True, "simulated_users": len(simulated_users), "total_users": total_users}
 
 
 @api_router.delete("/simulate/users/{room_id}")
 async def remove_simulated_users(room_id: str):
     """Remove all simulated users from a room"""
     removed = 0
-    if room_id in room_users:
-        to_remove = [uid for uid, user in room_users[room_id].items() if user.get("simulated")]
+    users = room_users.get(room_id)
+    if users is not None:
+        to_remove = [uid for uid, user in users.items() if user.get("simulated")]
         for user_id in to_remove:
-            del room_users[room_id][user_id]
+            users.pop(user_id, None)
+            room_user_lists.pop(room_id, None)
             await manager.broadcast(room_id, {
                 "type": "user_left",
                 "userId": user_id
             })
             removed += 1
+        if not users and room_users.get(room_id) is users:
+            del room_users[room_id]
     
     return {"success": True, "removed": removed}
 
@@ -531,8 +1017,23 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+auto_persist_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def start_persister():
+    global auto_persist_task
+    persister.start()
+    auto_persist_task = asyncio.create_task(auto_persist_loop())
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if auto_persist_task is not None:
+        auto_persist_task.cancel()
+    # Save what changed since the last tick before the final flush
+    persist_dirty_rooms()
+    await persister.stop()
     client.close()
 
 # Serve static files from React build (for production)
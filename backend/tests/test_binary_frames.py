@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from pycrdt import Doc, Text
+
+import server
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent_text = []
+    
+    async def send_text(self, data: str):
+        self.sent_text.append(data)
+
+
+@pytest.fixture
+def room(monkeypatch):
+    """A room with one joined user; broadcasts are recorded instead of sent"""
+    room_id = "binary-frames"
+    broadcasts = []
+    
+    async def broadcast_bytes(room_id, data, exclude_client=None):
+        broadcasts.append((room_id, data, exclude_client))
+    
+    monkeypatch.setattr(server.manager, "broadcast_bytes", broadcast_bytes)
+    server.room_users[room_id] = {"alice": {"id": "alice", "ord": 7, "cursor_position": None}}
+    yield room_id, broadcasts
+    server.room_users.pop(room_id, None)
+    server.room_user_lists.pop(room_id, None)
+    server.room_ydocs.pop(room_id, None)
+    server.room_documents.pop(room_id, None)
+    server.room_sync_frames.pop(room_id, None)
+    server.dirty_rooms.discard(room_id)
+
+
+def handle(websocket, room_id, data):
+    asyncio.run(server.handle_binary_message(websocket, room_id, "alice", data))
+
+
+def test_empty_frame_is_ignored(room):
+    room_id, broadcasts = room
+    websocket = FakeWebSocket()
+    handle(websocket, room_id, b"")
+    assert websocket.sent_text == []
+    assert broadcasts == []
+
+
+def test_unknown_frame_type_is_ignored(room):
+    room_id, broadcasts = room
+    websocket = FakeWebSocket()
+    handle(websocket, room_id, b"\x7f\x01\x02")
+    assert websocket.sent_text == []
+    assert broadcasts == []
+    assert room_id not in server.room_ydocs
+
+
+def test_malformed_doc_update_is_rejected(room):
+    room_id, broadcasts = room
+    websocket = FakeWebSocket()
+    errors = server.metrics.error_count
+    handle(websocket, room_id, b"\x00\xff\xff\xff\xff")
+    assert websocket.sent_text == [server.ERROR_INVALID_UPDATE]
+    assert broadcasts == []
+    assert server.metrics.error_count == errors + 1
+    assert room_id not in server.dirty_rooms
+
+
+def test_malformed_doc_update_keeps_document(room):
+    room_id, broadcasts = room
+    doc = Doc()
+    text = doc.get("content", type=Text)
+    text += "hello"
+    handle(FakeWebSocket(), room_id, server.DOC_FRAME_PREFIX + doc.get_update())
+    assert len(broadcasts) == 1
+    
+    websocket = FakeWebSocket()
+    handle(websocket, room_id, b"\x00garbage")
+    assert websocket.sent_text == [server.ERROR_INVALID_UPDATE]
+    assert len(broadcasts) == 1
+    assert str(server.room_ydocs[room_id].get("content", type=Text)) == "hello"
+
+
+@pytest.mark.parametrize("data", [
+    b"\x01",
+    b"\x01\x00\x00\x00\x00",
+    server.CURSOR_FRAME.pack(server.FRAME_CURSOR, 0, 42) + b"\x00",
+])
+def test_cursor_frame_with_wrong_length_is_ignored(room, data):
+    room_id, broadcasts = room
+    websocket = FakeWebSocket()
+    handle(websocket, room_id, data)
+    assert websocket.sent_text == []
+    assert broadcasts == []
+    assert server.room_users[room_id]["alice"]["cursor_position"] is None
+
+
+def test_cursor_frame_gets_sender_ordinal(room):
+    room_id, broadcasts = room
+    handle(FakeWebSocket(), room_id, server.CURSOR_FRAME.pack(server.FRAME_CURSOR, 0, 42))
+    assert server.room_users[room_id]["alice"]["cursor_position"] == 42
+    assert broadcasts == [
+        (room_id, server.CURSOR_FRAME.pack(server.FRAME_CURSOR, 7, 42), "alice")
+    ]
+
+
+def test_cursor_frame_from_unknown_user_is_ignored(room):
+    room_id, broadcasts = room
+    asyncio.run(server.handle_binary_message(
+        FakeWebSocket(), room_id, "mallory", server.CURSOR_FRAME.pack(server.FRAME_CURSOR, 0, 1)
+    ))
+    assert broadcasts == []
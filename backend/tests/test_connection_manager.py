@@ -0,0 +1,93 @@
+import asyncio
+
+import server
+
+
+class FakeWebSocket:
+    """Records sends and closes; a blocked socket never completes a send"""
+    
+    def __init__(self, blocked: bool = False):
+        self.blocked = blocked
+        self.sent = []
+        self.close_code = None
+    
+    async def accept(self):
+        pass
+    
+    async def send(self, message: dict):
+        if self.blocked:
+            await asyncio.Event().wait()
+        self.sent.append(message)
+    
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_full_queue_closes_with_1013():
+    async def run():
+        manager = server.ConnectionManager()
+        fast_ws, slow_ws = FakeWebSocket(), FakeWebSocket(blocked=True)
+        fast = await manager.connect(fast_ws, "overflow", "fast")
+        slow = await manager.connect(slow_ws, "overflow", "slow")
+        
+        # The slow relay holds one frame in send, the rest fill its queue
+        for i in range(server.OUTBOUND_QUEUE_SIZE + 1):
+            await manager.broadcast_bytes("overflow", bytes([0, i % 256]))
+            await settle()
+        assert ("overflow", "slow") in manager.conns
+        assert slow_ws.close_code is None
+        
+        await manager.broadcast_bytes("overflow", b"\x00\xff")
+        await settle()
+        assert slow_ws.close_code == 1013
+        assert ("overflow", "slow") not in manager.conns
+        assert manager.room_index["overflow"] == ["fast"]
+        assert slow.relay_task.cancelled()
+        
+        # The fast client got every frame, then the user_left for the dropped one
+        assert fast_ws.sent[-1] == {
+            "type": "websocket.send",
+            "text": server.json_dumps({"type": "user_left", "userId": "slow"})
+        }
+        assert len(fast_ws.sent) == server.OUTBOUND_QUEUE_SIZE + 3
+        
+        assert manager.disconnect("overflow", "fast", fast)
+        await settle()
+    
+    asyncio.run(run())
+
+
+def test_dropped_client_is_not_dropped_twice():
+    async def run():
+        manager = server.ConnectionManager()
+        ws = FakeWebSocket()
+        conn = await manager.connect(ws, "twice", "a")
+        manager._drop("twice", "a", conn, 1013)
+        manager._drop("twice", "a", conn, 1011)
+        await settle()
+        assert ws.close_code == 1013
+        assert "twice" not in manager.room_index
+    
+    asyncio.run(run())
+
+
+def test_failed_send_closes_with_1011():
+    class BrokenWebSocket(FakeWebSocket):
+        async def send(self, message: dict):
+            raise RuntimeError("socket gone")
+    
+    async def run():
+        manager = server.ConnectionManager()
+        ws = BrokenWebSocket()
+        await manager.connect(ws, "broken", "a")
+        await manager.broadcast_bytes("broken", b"\x00\x01")
+        await settle()
+        assert ws.close_code == 1011
+        assert ("broken", "a") not in manager.conns
+    
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+import pytest
+
+from server import (
+    LATENCY_BUCKET_COUNT,
+    LATENCY_BUCKETS_PER_OCTAVE,
+    LATENCY_MIN_NS,
+    MetricsCollector,
+    latency_bucket,
+    latency_bucket_midpoint,
+)
+
+
+def test_latency_bucket_floor():
+    assert latency_bucket(0) == 0
+    assert latency_bucket(1) == 0
+    assert latency_bucket(LATENCY_MIN_NS) == 0
+
+
+def test_latency_bucket_octaves():
+    # Every doubling above the floor moves up one octave of buckets
+    for octave in range(1, 10):
+        assert latency_bucket(LATENCY_MIN_NS << octave) == octave * LATENCY_BUCKETS_PER_OCTAVE
+
+
+def test_latency_bucket_is_monotonic():
+    samples = [LATENCY_MIN_NS + i * 37 for i in range(5000)]
+    buckets = [latency_bucket(ns) for ns in samples]
+    assert buckets == sorted(buckets)
+
+
+def test_latency_bucket_clamps_to_last_bucket():
+    assert latency_bucket(10 ** 15) == LATENCY_BUCKET_COUNT - 1
+
+
+@pytest.mark.parametrize("latency_ns", [1_500, 50_000, 1_000_000, 250_000_000])
+def test_bucket_midpoint_within_bucket_error(latency_ns):
+    midpoint_ms = latency_bucket_midpoint(latency_bucket(latency_ns))
+    latency_ms = latency_ns / 1e6
+    # Half a bucket either way: 2 ** (0.5 / 16) - 1 ~ 2.2%
+    assert abs(midpoint_ms - latency_ms) / latency_ms < 0.023
+
+
+def test_percentiles_empty():
+    assert MetricsCollector().latency_percentiles(0.5, 0.95) == [0, 0]
+
+
+def test_percentiles_nearest_rank():
+    metrics = MetricsCollector()
+    latencies_ns = [(i + 1) * 10_000 for i in range(100)]  # 10µs .. 1ms
+    for ns in latencies_ns:
+        metrics.record_message_ns(ns)
+    p50, p95 = metrics.latency_percentiles(0.5, 0.95)
+    assert p50 == pytest.approx(latencies_ns[50] / 1e6, rel=0.023)
+    assert p95 == pytest.approx(latencies_ns[95] / 1e6, rel=0.023)
+
+
+def test_percentiles_sub_100us():
+    metrics = MetricsCollector()
+    for _ in range(10):
+        metrics.record_message_ns(40_000)
+    p50, p95 = metrics.latency_percentiles(0.5, 0.95)
+    assert p50 == pytest.approx(0.04, rel=0.023)
+    assert p95 == pytest.approx(0.04, rel=0.023)
+
+
+def test_percentiles_follow_rolling_window():
+    metrics = MetricsCollector()
+    for _ in range(1000):
+        metrics.record_message_ns(5_000_000)
+    for _ in range(1000):
+        metrics.record_message_ns(20_000)
+    # The 5ms samples have all been evicted from the histogram
+    assert sum(metrics.latency_hist) == 1000
+    assert metrics.latency_percentiles(0.95) == [pytest.approx(0.02, rel=0.023)]
+
+
+def test_zero_latency_counts_message_only():
+    metrics = MetricsCollector()
+    metrics.record_message_ns(0)
+    assert metrics.message_count == 1
+    assert len(metrics.latency_window) == 0
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+class FakeCollection:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches = []
+    
+    async def bulk_write(self, ops, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("mongo down")
+        self.batches.append({op._filter["room_id"]: op._doc["$set"] for op in ops})
+
+
+class FakeDB:
+    def __init__(self, failures: int = 0):
+        self.room_documents = FakeCollection(failures)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(failures: int = 0) -> FakeCollection:
+        db = FakeDB(failures)
+        monkeypatch.setattr(server, "db", db)
+        return db.room_documents
+    
+    yield install
+    server.dirty_rooms.clear()
+
+
+def test_snapshots_coalesce_per_room(fake_db):
+    collection = fake_db()
+    
+    async def run():
+        persister = server.DocumentPersister(batch_timeout=0.05)
+        persister.start()
+        persister.enqueue("a", b"old")
+        persister.enqueue("b", b"b")
+        persister.enqueue("a", b"new")
+        assert len(persister.pending) == 2
+        await persister.stop()
+    
+    asyncio.run(run())
+    assert len(collection.batches) == 1
+    batch = collection.batches[0]
+    assert bytes(batch["a"]["data"]) == b"new"
+    assert batch["a"]["size"] == 3
+    assert bytes(batch["b"]["data"]) == b"b"
+
+
+def test_batches_are_capped_at_batch_size(fake_db):
+    collection = fake_db()
+    
+    async def run():
+        persister = server.DocumentPersister(batch_size=2, batch_timeout=10)
+        persister.start()
+        for room_id in "abcde":
+            persister.enqueue(room_id, room_id.encode())
+        await persister.stop()
+    
+    asyncio.run(run())
+    assert [sorted(batch) for batch in collection.batches] == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_failed_write_marks_rooms_dirty(fake_db):
+    collection = fake_db(failures=1)
+    
+    async def run():
+        persister = server.DocumentPersister(batch_timeout=0.01)
+        persister.start()
+        persister.enqueue("f", b"f")
+        persister.enqueue("g", b"g")
+        await persister.stop()
+    
+    asyncio.run(run())
+    assert collection.batches == []
+    assert server.dirty_rooms == {"f", "g"}
+
+
+def test_failed_rooms_are_written_on_the_next_persist(fake_db, monkeypatch):
+    collection = fake_db(failures=1)
+    room_id = "retry"
+    
+    async def run():
+        persister = server.DocumentPersister(batch_timeout=0.01)
+        monkeypatch.setattr(server, "persister", persister)
+        persister.start()
+        persister.enqueue(room_id, b"stale")
+        await asyncio.sleep(0.05)
+        assert room_id in server.dirty_rooms
+        # The next auto-persist tick queues whatever state is current then
+        server.apply_room_update(room_id, server.Doc().get_update())
+        server.persist_dirty_rooms()
+        await persister.stop()
+    
+    try:
+        asyncio.run(run())
+        state = server.get_room_state(room_id)
+    finally:
+        server.room_ydocs.pop(room_id, None)
+        server.room_documents.pop(room_id, None)
+        server.room_sync_frames.pop(room_id, None)
+    assert [list(batch) for batch in collection.batches] == [[room_id]]
+    assert bytes(collection.batches[0][room_id]["data"]) == state
+    assert room_id not in server.dirty_rooms
+
+
+def test_stop_without_start_flushes_pending(fake_db):
+    collection = fake_db()
+    
+    async def run():
+        persister = server.DocumentPersister()
+        persister.enqueue("h", b"h")
+        await persister.stop()
+    
+    asyncio.run(run())
+    assert [list(batch) for batch in collection.batches] == [["h"]]
@@ -26,19 +26,37 @@ const getWsUrl = () => {
 const BACKEND_URL = getBackendUrl();
 const WS_URL = getWsUrl();
 
-// Helper functions for hex encoding/decoding (browser-compatible)
-const toHex = (uint8Array) => {
-  return Array.from(uint8Array)
-    .map(b => b.toString(16).padStart(2, '0'))
-    .join('');
+// Binary frame types - first byte of every binary WebSocket frame
+const FRAME_DOC_UPDATE = 0x00;
+const FRAME_CURSOR = 0x01;
+// Full document state, zlib-compressed; the server uses it for large sync snapshots
+const FRAME_DOC_DEFLATE = 0x02;
+// Cursor frame: type (u8) + sender ordinal (u32, set by the server) + position (i32), little-endian
+const CURSOR_FRAME_SIZE = 9;
+
+const encodeDocFrame = (update) => {
+  const frame = new Uint8Array(update.length + 1);
+  frame[0] = FRAME_DOC_UPDATE;
+  frame.set(update, 1);
+  return frame;
 };
 
-const fromHex = (hexString) => {
-  const bytes = [];
-  for (let i = 0; i < hexString.length; i += 2) {
-    bytes.push(parseInt(hexString.substr(i, 2), 16));
-  }
-  return new Uint8Array(bytes);
+const inflate = async (bytes) => {
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+};
+
+const encodeCursorFrame = (position) => {
+  const view = new DataView(new ArrayBuffer(CURSOR_FRAME_SIZE));
+  view.setUint8(0, FRAME_CURSOR);
+  view.setInt32(5, position, true);
+  return view.buffer;
+};
+
+// Handling latency is usually well under a millisecond, so show those in µs
+const formatLatency = (ms) => {
+  if (!ms) return '0 ms';
+  return ms < 1 ? `${Math.round(ms * 1000)} µs` : `${ms.toFixed(1)} ms`;
 };
 
 // Get user from localStorage or redirect to home
@@ -88,7 +106,8 @@ const EditorPage = () => {
   const reconnectTimeoutRef = useRef(null);
   const editorRef = useRef(null);
   const isLocalUpdateRef = useRef(false);
-  const lastSentStateRef = useRef('');
+  // Server-assigned ordinal -> remote user id, for decoding binary cursor frames
+  const userOrdsRef = useRef({});
   const cursorOverlayRef = useRef(null);
 
   // Calculate cursor position in pixels from character index
@@ -158,6 +177,14 @@ const EditorPage = () => {
     
     ytextRef.current.observe(observer);
     
+    // Send local edits to the server as incremental updates
+    const onUpdate = (update, origin) => {
+      if (origin === 'local' && wsRef.current?.readyState === WebSocket.OPEN) {
+        wsRef.current.send(encodeDocFrame(update));
+      }
+    };
+    ydocRef.current.on('update', onUpdate);
+    
     return () => {
       ytextRef.current?.unobserve(observer);
       ydocRef.current?.destroy();
@@ -167,34 +194,6 @@ const EditorPage = () => {
   // Handle incoming messages
   const handleMessage = useCallback((message) => {
     switch (message.type) {
-      case 'sync':
-        if (message.data) {
-          try {
-            const update = fromHex(message.data);
-            Y.applyUpdate(ydocRef.current, update);
-            const newContent = ytextRef.current.toString();
-            setContent(newContent);
-            console.log('Synced content:', newContent.slice(0, 50) + '...');
-          } catch (e) {
-            console.error('Sync error:', e);
-          }
-        }
-        break;
-        
-      case 'update':
-        if (message.data && message.from !== sessionIdRef.current) {
-          try {
-            const update = fromHex(message.data);
-            Y.applyUpdate(ydocRef.current, update);
-            const newContent = ytextRef.current.toString();
-            setContent(newContent);
-            console.log('Remote update received:', newContent.slice(0, 50) + '...');
-          } catch (e) {
-            console.error('Update error:', e);
-          }
-        }
-        break;
-
       case 'cursor':
         // Update remote user cursor position
         if (message.userId && message.userId !== sessionIdRef.current) {
@@ -213,6 +212,9 @@ const EditorPage = () => {
       case 'user_joined':
         // Add new user to the list
         if (message.userId && message.userId !== sessionIdRef.current) {
+          if (message.ord != null) {
+            userOrdsRef.current[message.ord] = message.userId;
+          }
           setRemoteUsers(prev => ({
             ...prev,
             [message.userId]: {
@@ -224,6 +226,25 @@ const EditorPage = () => {
         }
         break;
 
+      case 'users_joined':
+        // Batch of users added at once (load-test simulation)
+        if (message.users) {
+          setRemoteUsers(prev => {
+            const updated = { ...prev };
+            message.users.forEach(user => {
+              if (user.id !== sessionIdRef.current) {
+                updated[user.id] = {
+                  name: user.name || 'Anonymous',
+                  color: user.color || '#3B82F6',
+                  cursorPosition: typeof user.cursor_position === 'number' ? user.cursor_position : null
+                };
+              }
+            });
+            return updated;
+          });
+        }
+        break;
+
       case 'user_left':
         // Remove user from the list
         if (message.userId) {
@@ -241,6 +262,9 @@ const EditorPage = () => {
           const users = {};
           message.users.forEach(user => {
             if (user.id !== sessionIdRef.current) {
+              if (user.ord != null) {
+                userOrdsRef.current[user.ord] = user.id;
+              }
               users[user.id] = {
                 name: user.name || 'Anonymous',
                 color: user.color || '#3B82F6',
@@ -257,12 +281,39 @@ const EditorPage = () => {
     }
   }, []);
 
+  // Handle incoming binary frames
+  const handleBinaryFrame = useCallback((frame) => {
+    if (frame[0] === FRAME_DOC_UPDATE) {
+      // Yjs update (full state on sync, incremental for remote edits)
+      Y.applyUpdate(ydocRef.current, frame.subarray(1));
+      setContent(ytextRef.current.toString());
+    } else if (frame[0] === FRAME_DOC_DEFLATE) {
+      // Yjs updates commute, so applying this after later frames is fine
+      inflate(frame.subarray(1)).then((update) => {
+        Y.applyUpdate(ydocRef.current, update);
+        setContent(ytextRef.current.toString());
+      }).catch((e) => console.error('Failed to decompress document:', e));
+    } else if (frame[0] === FRAME_CURSOR && frame.length === CURSOR_FRAME_SIZE) {
+      const view = new DataView(frame.buffer, frame.byteOffset, frame.byteLength);
+      const userId = userOrdsRef.current[view.getUint32(1, true)];
+      const position = view.getInt32(5, true);
+      if (userId && userId !== sessionIdRef.current) {
+        setRemoteUsers(prev => (prev[userId] ? {
+          ...prev,
+          [userId]: { ...prev[userId], cursorPosition: position }
+        } : prev));
+      }
+    }
+  }, []);
+
   // WebSocket connection
   const connect = useCallback(() => {
     if (!currentUser || !currentUser.id) return;
     
     try {
       const ws = new WebSocket(`${WS_URL}/api/ws/${roomId}?client_id=${sessionIdRef.current}`);
+      // Document sync/updates and cursor positions arrive as binary frames
+      ws.binaryType = 'arraybuffer';
       wsRef.current = ws;
 
       ws.onopen = () => {
@@ -280,6 +331,9 @@ const EditorPage = () => {
         ws.send(JSON.stringify({
           type: 'sync_request'
         }));
+        
+        // Push local state so edits made while disconnected get merged
+        ws.send(encodeDocFrame(Y.encodeStateAsUpdate(ydocRef.current)));
       };
 
       ws.onmessage = (event) => {
@@ -288,10 +342,7 @@ const EditorPage = () => {
             const message = JSON.parse(event.data);
             handleMessage(message);
           } else {
-            // Binary message - Yjs update
-            const update = new Uint8Array(event.data);
-            Y.applyUpdate(ydocRef.current, update);
-            setContent(ytextRef.current.toString());
+            handleBinaryFrame(new Uint8Array(event.data));
           }
         } catch (e) {
           console.error('Failed to parse message:', e);
@@ -314,7 +365,7 @@ const EditorPage = () => {
     } catch (e) {
       console.error('Connection error:', e);
     }
-  }, [roomId, currentUser, handleMessage]);
+  }, [roomId, currentUser, handleMessage, handleBinaryFrame]);
 
   // Connect on mount
   useEffect(() => {
@@ -377,45 +428,19 @@ const EditorPage = () => {
     
     setContent(newContent);
     
-    // Send update to server
+    // The document update itself is sent by the Yjs 'update' listener;
+    // also send cursor position on every keystroke
     if (wsRef.current?.readyState === WebSocket.OPEN) {
-      const update = Y.encodeStateAsUpdate(ydocRef.current);
-      const hexData = toHex(update);
-      
-      // Only send if the state actually changed
-      if (hexData !== lastSentStateRef.current) {
-        lastSentStateRef.current = hexData;
-        wsRef.current.send(JSON.stringify({
-          type: 'update',
-          data: hexData
-        }));
-        console.log('Sent update, content:', newContent.slice(0, 50) + '...');
-      }
-      
-      // Also send cursor position on every keystroke
-      const cursorPos = e.target.selectionStart;
-      wsRef.current.send(JSON.stringify({
-        type: 'cursor',
-        userId: sessionIdRef.current,
-        name: currentUser.name,
-        color: currentUser.color,
-        position: cursorPos
-      }));
+      wsRef.current.send(encodeCursorFrame(e.target.selectionStart));
     }
-  }, [currentUser]);
+  }, []);
 
   // Send cursor position to other users
   const sendCursorPosition = useCallback((position) => {
     if (wsRef.current?.readyState === WebSocket.OPEN) {
-      wsRef.current.send(JSON.stringify({
-        type: 'cursor',
-        userId: sessionIdRef.current,
-        name: currentUser.name,
-        color: currentUser.color,
-        position: position
-      }));
+      wsRef.current.send(encodeCursorFrame(position));
     }
-  }, [currentUser]);
+  }, []);
 
   // Handle cursor/selection changes
   const handleSelect = useCallback((e) => {
@@ -676,11 +701,11 @@ const EditorPage = () => {
                   </div>
                   <div className={`p-2 sm:p-3 rounded-lg ${darkMode ? 'bg-gray-700' : 'bg-gray-50'}`}>
                     <div className={`text-[10px] sm:text-xs uppercase tracking-wide ${darkMode ? 'text-gray-400' : 'text-gray-500'}`}>P50 Latency</div>
-                    <div className={`text-lg sm:text-2xl font-bold ${darkMode ? 'text-white' : 'text-gray-900'}`}>{metrics.p50_latency_ms?.toFixed(1) || '0'} ms</div>
+                    <div className={`text-lg sm:text-2xl font-bold ${darkMode ? 'text-white' : 'text-gray-900'}`}>{formatLatency(metrics.p50_latency_ms)}</div>
                   </div>
                   <div className={`p-2 sm:p-3 rounded-lg ${darkMode ? 'bg-gray-700' : 'bg-gray-50'}`}>
                     <div className={`text-[10px] sm:text-xs uppercase tracking-wide ${darkMode ? 'text-gray-400' : 'text-gray-500'}`}>P95 Latency</div>
-                    <div className={`text-lg sm:text-2xl font-bold ${darkMode ? 'text-white' : 'text-gray-900'}`}>{metrics.p95_latency_ms?.toFixed(1) || '0'} ms</div>
+                    <div className={`text-lg sm:text-2xl font-bold ${darkMode ? 'text-white' : 'text-gray-900'}`}>{formatLatency(metrics.p95_latency_ms)}</div>
                   </div>
                   <div className={`p-2 sm:p-3 rounded-lg ${darkMode ? 'bg-gray-700' : 'bg-gray-50'}`}>
                     <div className={`text-[10px] sm:text-xs uppercase tracking-wide ${darkMode ? 'text-gray-400' : 'text-gray-500'}`}>Errors</div>